@@ -16,9 +16,9 @@ def mag2_mp_1(H_coeff, rho0, tlist):
     for i in range(len(tlist) - 1):
         omega = magnus1_mp(H_coeff, tlist[i], tlist[i+1]) + mp._magnus_second_term([H_coeff], np.zeros((2,2)), tlist[i], tlist[i+1])
         states.append(sp.linalg.expm(np.asarray(omega)) @ states[i])
-        states[i] = mp.unvec(states[i])
+        states[i] = mp.unvec_square(states[i])
         
-    states[-1] = mp.unvec(states[-1])
+    states[-1] = mp.unvec_square(states[-1])
     
     return states
 
@@ -50,8 +50,8 @@ def mag2_glqn_1(H_coeff, rho0, tlist, ord):
     for i in range(len(tlist) - 1):
         omega = magnus1_glq(H_coeff, tlist[i], tlist[i+1], ord) + magnus_second_term_one_particle(H_coeff, tlist[i], tlist[i+1])
         states.append(sp.linalg.expm(omega) @ states[i])
-        states[i] = mp.unvec(states[i])
+        states[i] = mp.unvec_square(states[i])
 
-    states[-1] = mp.unvec(states[-1])
+    states[-1] = mp.unvec_square(states[-1])
 
     return states
\ No newline at end of file
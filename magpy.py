@@ -1,3 +1,5 @@
+from math import isqrt
+
 import numpy as np
 import scipy.integrate
 
@@ -18,6 +20,8 @@ def vec(mat):
     """
     Return vectorised form of input using column-major (Fortran) ordering.
 
+    No copy is made if the input is already Fortran-contiguous.
+
     Parameters
     ----------
     mat : ndarray
@@ -30,7 +34,7 @@ def vec(mat):
 
     """
 
-    return np.asarray(mat).flatten('F')
+    return np.asarray(mat).ravel('F')
 
 
 def unvec(vec, c=None):
@@ -52,7 +56,7 @@ def unvec(vec, c=None):
 
     """
 
-    vec = np.array(vec)
+    vec = np.asarray(vec)
 
     # odd number of elements
     if (len(vec) % 2 != 0):
@@ -64,9 +68,8 @@ def unvec(vec, c=None):
             return None
     elif c is None:
         # matrix is square
-        if (np.sqrt(len(vec)).is_integer()):
-            c = int(np.sqrt(len(vec)))
-        else:
+        c = isqrt(len(vec))
+        if (c*c != len(vec)):
             print("Error: vector cannot form a square matrix. \
                   Please provide a column length, c.")
             return None
@@ -82,6 +85,29 @@ def unvec(vec, c=None):
     return vec.reshape((c, n), order='F')
 
 
+def unvec_square(vec):
+    """
+    Return square matrix from vector using column-major (Fortran) ordering.
+
+    Unlike unvec, the input is not validated, so this is suited to
+    repeated conversions of vectorised density matrices.
+
+    Parameters
+    ----------
+    vec : ndarray
+        Vector of n^2 elements.
+
+    Returns
+    -------
+    ndarray
+        Square matrix with dimension n.
+
+    """
+
+    n = isqrt(vec.size)
+    return vec.reshape((n, n), order='F')
+
+
 def liouvillian(H):
     """
     Return Liouvillian of a Hamiltonian.
@@ -103,6 +129,69 @@ def liouvillian(H):
     return -1j * (np.kron(np.eye(n), H) - np.kron(H.T, np.eye(n)))
 
 
+class LiouvillianOp:
+    """
+    Matrix-free Liouvillian of a Hamiltonian.
+
+    Acts on vectorised matrices as coeff * (H @ R - R @ H), which equals
+    (1j * coeff) * liouvillian(H) applied to vec(R), without forming any
+    matrix of dimension n^2.
+
+    Parameters
+    ----------
+    H : ndarray
+        Square matrix with dimension n.
+    coeff : complex, optional
+        Scalar multiplying the commutator. The default is -1j.
+
+    """
+
+    def __init__(self, H, coeff=-1j):
+        self.H = np.asarray(H)
+        self.coeff = coeff
+        self.n = self.H.shape[0]
+        self.shape = (self.n**2, self.n**2)
+        self.dtype = np.result_type(self.H, complex)
+
+    def __matmul__(self, v):
+        R = np.asarray(v).reshape((self.n, self.n), order='F')
+        return self.coeff * (self.H @ R - R @ self.H).flatten('F')
+
+    def __mul__(self, c):
+        return LiouvillianOp(self.H, self.coeff * c)
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return LiouvillianOp(self.H, -self.coeff)
+
+    def conj(self):
+        return LiouvillianOp(self.H.conj(), np.conj(self.coeff))
+
+    @property
+    def T(self):
+        return LiouvillianOp(self.H.T, self.coeff)
+
+    @property
+    def is_hermitian(self):
+        # the Liouvillian is Hermitian if coeff * H is
+        K = self.coeff * self.H
+        return np.allclose(K, K.conj().T, atol=1e-12, rtol=0)
+
+    def toarray(self):
+        """
+        Return Liouvillian as a dense matrix.
+
+        Returns
+        -------
+        ndarray
+            Square matrix with dimension n^2.
+
+        """
+
+        return 1j * self.coeff * liouvillian(self.H)
+
+
 def commutator(A, B, kind="normal"):
     """
     Return commutator of kind of A and B.
@@ -197,6 +286,11 @@ def linspace(start, stop, step, dtype=None):
             .astype(dtype))
 
 
+def _dense(x):
+    # ndarray from ndarray-like or Qobj
+    return x.full() if hasattr(x, "full") else np.asarray(x)
+
+
 def frobenius(a, b):
     """
     Return Frobenius/trace inner product of a and b.
@@ -224,19 +318,21 @@ def frobenius(a, b):
 
     """
 
-    a = np.asarray(a, dtype=object)
-    b = np.asarray(b, dtype=complex)
+    # a is a sequence of matrices, which may be Qobj
+    if (isinstance(a, (list, tuple))
+            or (isinstance(a, np.ndarray) and a.dtype == object)):
+        a = np.stack([_dense(x) for x in a])
+    else:
+        a = _dense(a)
+    b = np.asarray(_dense(b), dtype=complex)
 
+    # tr(x^H b) is the sum of the element-wise product of conj(x) and b
     # a is an array
-    try:
-        t = []
-        for x in a:
-            t.append(np.trace(x.conj().T @ b))
-        return np.asarray(t)
+    if a.ndim == 3:
+        return np.einsum('kij,ij->k', a.conj(), b, optimize=True)
 
     # a is single
-    except:
-        return np.trace(a.conj().T @ b)
+    return np.einsum('ij,ij->', a.conj(), b)
 
 
 def _magnus_first_term(H_coeffs, HJ, t0, tf):
@@ -361,8 +457,8 @@ def lvnsolve(H_coeffs, rho0, tlist, HJ=None):
         omega = (_magnus_first_term(H_coeffs, HJ, tlist[i], tlist[i+1])
                  + _magnus_second_term(H_coeffs, HJ, tlist[i], tlist[i+1]))
         states.append(scipy.linalg.expm(omega) @ states[i])
-        states[i] = unvec(states[i])
+        states[i] = unvec_square(states[i])
 
-    states[-1] = unvec(states[-1])
+    states[-1] = unvec_square(states[-1])
 
     return states
@@ -3,33 +3,117 @@ import numpy as np
 import scipy as sp
 import qutip as qt
 import matplotlib.pyplot as plt
-
-def lanczos(A, b, m=None):
+from functools import lru_cache
+from numba import njit
+
+@njit(cache=True, fastmath=True)
+def _lanczos_step(w_re, w_im, v_re, v_im, vp_re, vp_im, beta):
+    # orthogonalise w = A v against the two latest Lanczos vectors, with real
+    # and imaginary parts held in separate arrays; alpha is real as A is Hermitian
+    alpha = 0.0
+    for k in range(w_re.shape[0]):
+        alpha += v_re[k]*w_re[k] + v_im[k]*w_im[k]
+    for k in range(w_re.shape[0]):
+        w_re[k] -= alpha*v_re[k] + beta*vp_re[k]
+        w_im[k] -= alpha*v_im[k] + beta*vp_im[k]
+    return alpha
+
+def _as_operator(A, n):
+    # callables acting on vectors are wrapped as n x n linear operators
+    if callable(A) and not hasattr(A, "shape"):
+        return sp.sparse.linalg.LinearOperator((n, n), matvec=A, dtype='complex')
+    return A
+
+def lanczos(A, b, m=30):
+    A = _as_operator(A, len(b))
     n = A.shape[0]
-    if m is None:
-        m = n
-    V = np.zeros((n, m), dtype='complex')
-    W = np.zeros((n, m), dtype='complex')
-    alpha = np.zeros((m, 1), dtype='complex')
-    beta = np.zeros((m, 1), dtype='complex')
+    m = n if m is None else min(m, n)
+    V_re = np.zeros((n, m), order='F')
+    V_im = np.zeros((n, m), order='F')
+    alpha = np.zeros(m)
+    beta = np.zeros(m)
     
-    V[:, 0] = b / np.linalg.norm(b)
-    W[:, 0] = A @ V[:, 0]
-    alpha[0] = np.vdot(W[:, 0], V[:, 0])
-    W[:, 0] = W[:, 0] - alpha[0]*V[:, 0]
+    b_norm = np.linalg.norm(b)
+    v = b / b_norm
+    V_re[:, 0] = v.real
+    V_im[:, 0] = v.imag
     
-    for j in range(1, m):
-        beta[j] = np.linalg.norm(W[:, j-1])
-        V[:, j] = W[:, j-1] / beta[j]
-        W[:, j] = A @ V[:, j]
-        alpha[j] = np.vdot(W[:, j], V[:, j])
-        W[:, j] = W[:, j] - alpha[j]*V[:, j] - beta[j]*V[:, j-1]
-
-    return V, np.diagflat(alpha) + np.diagflat(beta[1:], 1) + np.diagflat(beta[1:], -1)
-
-def krylov_expm(A, b, m=None):
-    V, T = lanczos(A, b, m)
-    return np.linalg.norm(b) * V @ sp.linalg.expm(T) @ np.eye(1, T.shape[0])[0]
+    for j in range(m):
+        if j > 0:
+            beta[j] = np.sqrt(w_re @ w_re + w_im @ w_im)
+            if beta[j] < 1e-12: # happy breakdown, subspace is invariant
+                m = j
+                break
+            V_re[:, j] = w_re / beta[j]
+            V_im[:, j] = w_im / beta[j]
+        w = np.asarray(A @ (V_re[:, j] + 1j*V_im[:, j]), dtype='complex')
+        w_re = np.ascontiguousarray(w.real)
+        w_im = np.ascontiguousarray(w.imag)
+        # V[:, j-1] is unused when j = 0 as beta[0] = 0
+        alpha[j] = _lanczos_step(w_re, w_im, V_re[:, j], V_im[:, j], V_re[:, j-1], V_im[:, j-1], beta[j])
+
+    # write the three diagonals of T in place
+    T = np.zeros((m, m))
+    i = np.arange(m)
+    T[i, i] = alpha[:m]
+    T[i[:-1], i[1:]] = beta[1:m]
+    T[i[1:], i[:-1]] = beta[1:m]
+    return V_re[:, :m] + 1j*V_im[:, :m], T, b_norm
+
+@njit(cache=True, fastmath=True)
+def _arnoldi_step(V, H, w, j):
+    # modified Gram-Schmidt of w = A V[:, j] against the columns V[:, :j+1]
+    for i in range(j + 1):
+        dot = 0j
+        for k in range(w.shape[0]):
+            dot += V[k, i].conjugate() * w[k]
+        H[i, j] = dot
+        for k in range(w.shape[0]):
+            w[k] -= dot * V[k, i]
+
+def arnoldi(A, b, m=30):
+    A = _as_operator(A, len(b))
+    n = A.shape[0]
+    m = n if m is None else min(m, n)
+    V = np.zeros((n, m+1), dtype='complex', order='F')
+    H = np.zeros((m+1, m), dtype='complex')
+
+    b_norm = np.linalg.norm(b)
+    V[:, 0] = b / b_norm
+    for j in range(m):
+        w = np.asarray(A @ V[:, j], dtype='complex')
+        _arnoldi_step(V, H, w, j)
+        H[j+1, j] = np.linalg.norm(w)
+        if np.abs(H[j+1, j]) < 1e-12: # happy breakdown, subspace is invariant
+            m = j + 1
+            break
+        V[:, j+1] = w / H[j+1, j]
+
+    return V[:, :m], H[:m, :m], b_norm
+
+def _is_hermitian(A, tol=1e-12):
+    # operators such as mp.LiouvillianOp know whether they are Hermitian
+    if hasattr(A, "is_hermitian"):
+        return A.is_hermitian
+    if sp.sparse.issparse(A):
+        return abs(A - A.conj().T).max() <= tol
+    if isinstance(A, np.ndarray):
+        return np.allclose(A, A.conj().T, atol=tol, rtol=0)
+    # no cheap test for general operators, and Arnoldi is always valid
+    return False
+
+def krylov_expm(A, b, m=30, hermitian=None):
+    if hermitian is None:
+        hermitian = _is_hermitian(A)
+
+    if hermitian:
+        # e^T e_1 from the eigendecomposition of the real tridiagonal T
+        V, T, b_norm = lanczos(A, b, m)
+        w, S = sp.linalg.eigh_tridiagonal(np.real(np.diag(T)), np.real(np.diag(T, -1)))
+        return b_norm * V @ (S @ (np.exp(w) * S[0, :]))
+
+    V, H, b_norm = arnoldi(A, b, m)
+    return b_norm * V @ sp.linalg.expm(H)[:, 0]
 
 def loglog_plot(data, ref, data_range, plot_range=None, best_fit_range=None, plot_best_fit=False, label=None, ax=None):
     steps = []
@@ -65,10 +149,10 @@ def krylov_lvn(H, rho0, tlist, m, midpoint=False):
     states = [mp.vec(rho0)]
     
     for i in range(len(tlist) - 1):
-        A = np.asarray(mp.liouvillian(H(tlist[i] + midpoint*0.5*h)))
+        A = mp.LiouvillianOp(H(tlist[i] + midpoint*0.5*h))
         states.append(krylov_expm(h * A, states[i], m))
-        states[i] = mp.unvec(states[i])
-    states[-1] = mp.unvec(states[-1])
+        states[i] = mp.unvec_square(states[i])
+    states[-1] = mp.unvec_square(states[-1])
     
     return states
 
@@ -79,20 +163,30 @@ def expm_lvn(H, rho0, tlist, midpoint=False):
     for i in range(len(tlist) - 1):
         A = np.asarray(mp.liouvillian(H(tlist[i] + midpoint*0.5*h)))
         states.append(sp.linalg.expm(h * A) @ states[i])
-        states[i] = mp.unvec(states[i])
-    states[-1] = mp.unvec(states[-1])
+        states[i] = mp.unvec_square(states[i])
+    states[-1] = mp.unvec_square(states[-1])
     
     return states
 
+def one_spin_step(coeffs, rho):
+    # expm(liouvillian(x*sigmax + y*sigmay + z*sigmaz)) @ rho in closed form,
+    # using exp(-i a.sigma) = cos|a| I - i sin|a| a.sigma / |a|
+    x, y, z = coeffs
+    r = np.sqrt(x*x + y*y + z*z)
+    c = np.cos(r)
+    s = np.sinc(r / np.pi) # sin(r)/r
+    U = np.array([[c - 1j*s*z, -1j*s*(x - 1j*y)], [-1j*s*(x + 1j*y), c + 1j*s*z]])
+    R = rho.reshape((2, 2), order='F')
+    return (U @ R @ U.conj().T).ravel('F')
+
 def expm_one_spin(data, rho0, tlist):
     h = tlist[1] - tlist[0]
     states = [mp.vec(rho0)]
     
     for i in range(len(tlist) - 1):
-        A = np.asarray(mp.liouvillian(data[i][0]*mp.sigmax + data[i][1]*mp.sigmay + data[i][2]*mp.sigmaz))
-        states.append(sp.linalg.expm(A) @ states[i])
-        states[i] = mp.unvec(states[i])
-    states[-1] = mp.unvec(states[-1])
+        states.append(one_spin_step(data[i], states[i]))
+        states[i] = mp.unvec_square(states[i])
+    states[-1] = mp.unvec_square(states[-1])
     
     return states
 
@@ -105,9 +199,9 @@ def forward_euler_lvn(H, rho0, tlist, midpoint=False):
         fe = np.eye(A.shape[0]) + h*A
         
         states.append(fe @ states[i])
-        states[i] = mp.unvec(states[i])
+        states[i] = mp.unvec_square(states[i])
 
-    states[-1] = mp.unvec(states[-1])
+    states[-1] = mp.unvec_square(states[-1])
 
     return states
 
@@ -120,9 +214,9 @@ def backward_euler_lvn(H, rho0, tlist, midpoint=False):
         be = sp.linalg.inv(np.eye(A.shape[0]) - h*A)
         
         states.append(be @ states[i])
-        states[i] = mp.unvec(states[i])
+        states[i] = mp.unvec_square(states[i])
 
-    states[-1] = mp.unvec(states[-1])
+    states[-1] = mp.unvec_square(states[-1])
     
     return states
 
@@ -136,8 +230,8 @@ def trapezoidal_rule_lvn(H, rho0, tlist, midpoint=False):
         tr = sp.linalg.inv(I - (h/2)*A) @ (I + (h/2)*A)
         
         states.append(tr @ states[i])
-        states[i] = mp.unvec(states[i])
-    states[-1] = mp.unvec(states[-1])
+        states[i] = mp.unvec_square(states[i])
+    states[-1] = mp.unvec_square(states[-1])
 
     return states
 
@@ -153,8 +247,8 @@ def rk4_lvn(H, rho0, tlist, midpoint=False):
         k4 = A @ (states[i] + h*k3)
         
         states.append(states[i] + (1/6)*h*(k1 + 2*k2 + 2*k3 + k4))
-        states[i] = mp.unvec(states[i])
-    states[-1] = mp.unvec(states[-1])
+        states[i] = mp.unvec_square(states[i])
+    states[-1] = mp.unvec_square(states[-1])
     
     return states
 
@@ -216,10 +310,27 @@ def trapezoidal_rule_exp(A, h):
     p = int(1/h)
     return np.linalg.matrix_power(M, p)
 
+def _pade_coeffs(p, q):
+    # coefficients of the degree p numerator of the (p,q) Padé approximant
+    i = np.arange(p + 1)
+    f = sp.special.factorial
+    return f(p + q - i) * f(p) / (f(p + q) * f(i) * f(p - i))
+
+def _horner(c, A):
+    # matrix polynomial sum_i c[i] A^i by Horner's scheme
+    I = np.eye(A.shape[0])
+    M = c[-1] * I
+    for ci in c[-2::-1]:
+        M = M @ A + ci*I
+    return M
+
 def pade_expm(A, p, q):
     """
     Approximation of matrix exponential of A using (p,q) Padé approximants.
 
+    A is scaled by 2^-s so that its infinity norm is at most 1, and the
+    approximant is squared s times.
+
     Parameters
     ----------
     A : ndarray
@@ -234,20 +345,18 @@ def pade_expm(A, p, q):
     ndarray
         The Padé approximant of exp(A)
     """
-    N = 0
-    D = 0
+    norm = np.linalg.norm(A, np.inf)
+    s = int(np.ceil(np.log2(norm))) if norm > 1 else 0
+    As = A / 2**s
 
-    f_p = sp.special.factorial(p)
-    f_q = sp.special.factorial(q)
-    f_p_q = sp.special.factorial(p+q)
+    N = _horner(_pade_coeffs(p, q), As)
+    D = _horner(_pade_coeffs(q, p), -As)
+    X = sp.linalg.solve(D, N, assume_a='gen', overwrite_a=True, overwrite_b=True)
 
-    for i in range(0,p+1):
-        N += ((sp.special.factorial(p + q - i) * f_p) / (f_p_q * sp.special.factorial(i) * sp.special.factorial(p-i))) * np.linalg.matrix_power(A,i)
+    for _ in range(s):
+        X = X @ X
     
-    for i in range(0,q+1):
-        D += ((sp.special.factorial(p + q - i) * f_q) / (f_p_q * sp.special.factorial(i) * sp.special.factorial(q-i))) * np.linalg.matrix_power(-A,i)
-    
-    return np.dot(np.linalg.inv(D),N)
+    return X
    
 def rand_skew_herm(n):
     u = np.triu(np.random.rand(n, n) + 1j*np.random.rand(n, n), 1)
@@ -259,7 +368,65 @@ def rand_herm_neg_semi_def(n):
     B = np.random.rand(n, n) + 1j*np.random.rand(n, n)
     return -B @ B.conj().T
 
-def pre_integrate(H_coeff, tlist, method):
+@lru_cache(maxsize=16)
+def _leggauss(deg):
+    # cached arrays are shared between callers, so make them read-only
+    x, w = np.polynomial.legendre.leggauss(deg)
+    x.setflags(write=False)
+    w.setflags(write=False)
+    return x, w
+
+def _evaluate(f, xs):
+    # evaluate f on an array of points, pointwise if f is not vectorised
+    try:
+        return np.broadcast_to(f(xs), xs.shape)
+    except (TypeError, ValueError):
+        return np.array([f(t) for t in xs.ravel()]).reshape(xs.shape)
+
+def _gauss_legendre(f, a, b, deg, dtype=np.float64):
+    # integrals of f over [a, b] for scalar limits or arrays of limits,
+    # with f evaluated once on the nodes of every interval. Nodes are placed
+    # in double precision, only the weighted sum is carried out in dtype
+    x, w = _leggauss(deg)
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    h = 0.5*(b - a)
+    X = h[..., None]*x + (0.5*(b + a))[..., None]
+    vals = _evaluate(f, X)
+    if np.isrealobj(vals):
+        vals = vals.astype(dtype, copy=False)
+    return h.astype(dtype) * (vals @ w.astype(dtype, copy=False))
+
+def integrate(f, a, b, deg=100, dtype=np.float64):
+    """Integral of f over [a, b] using Gauss-Legendre quadrature.
+
+    f is evaluated once on all the quadrature nodes, falling back to
+    pointwise evaluation if it does not accept arrays.
+
+    Parameters
+    ----------
+    f : callable
+        Integrand.
+    a : float
+        Lower limit of integration.
+    b : float
+        Upper limit of integration.
+    deg : int, optional
+        Number of quadrature nodes, by default 100.
+    dtype : dtype, optional
+        Floating point type of the weights and function values in the
+        weighted sum, by default np.float64. The nodes are always placed in
+        double precision, so np.float32 limits the accuracy to single
+        precision relative to the integral, independent of where [a, b] lies.
+
+    Returns
+    -------
+    float
+        Approximation of the integral of f from a to b.
+    """
+    return _gauss_legendre(f, a, b, deg, dtype)[()]
+
+def pre_integrate(H_coeff, tlist, method, dtype=np.float64):
     data = []
     if method == "SCIPY":
         for i in range(len(tlist) - 1):
@@ -271,14 +438,13 @@ def pre_integrate(H_coeff, tlist, method):
             if not (i % 10000): 
                 print(i)
     elif method[:3] == "GLQ":
-        for i in range(len(tlist) - 1):
-            val = [0, 0, 0]
-            val[0] = sp.integrate.fixed_quad(H_coeff[0], tlist[i], tlist[i+1], n=int(method[3:]))
-            val[1] = sp.integrate.fixed_quad(H_coeff[1], tlist[i], tlist[i+1], n=int(method[3:]))
-            val[2] = H_coeff[2] * (tlist[i+1] - tlist[i])
-            data.append(val)
-            if not (i % 10000): 
-                print(i)
+        # one quadrature rule applied to every interval at once
+        deg = int(method[3:])
+        tlist = np.asarray(tlist)
+        data = np.empty((len(tlist) - 1, 3), dtype=dtype)
+        data[:, 0] = _gauss_legendre(H_coeff[0], tlist[:-1], tlist[1:], deg, dtype)
+        data[:, 1] = _gauss_legendre(H_coeff[1], tlist[:-1], tlist[1:], deg, dtype)
+        data[:, 2] = H_coeff[2] * np.diff(tlist)
     elif method == "IP":
         h = tlist[1] - tlist[0]
         for i in range(len(tlist) - 1):
@@ -301,10 +467,32 @@ def pre_integrate(H_coeff, tlist, method):
         print("Error: invalid method.")
         return 0
     
-    return data
+    return np.asarray(data, dtype=dtype)
 
 def one_spin(H_coeff):
-    def H(t, args=None): return H_coeff[0](t)*mp.sigmax + H_coeff[1](t)*mp.sigmay + H_coeff[2]*mp.sigmaz
+    f, g, omega = H_coeff
+    
+    # f(t)*sigmax + g(t)*sigmay + omega*sigmaz written out directly
+    def H(t, args=None):
+        ft = f(t)
+        gt = g(t)
+        return np.array([[omega, ft - 1j*gt], [ft + 1j*gt, -omega]], dtype=complex)
+    return H
+
+def one_spin_batch(H_coeff):
+    f, g, omega = H_coeff
+    
+    # Hamiltonians at every time in tlist, shape (len(tlist), 2, 2)
+    def H(tlist):
+        tlist = np.asarray(tlist, dtype=float)
+        ft = _evaluate(f, tlist)
+        gt = _evaluate(g, tlist)
+        out = np.empty((len(tlist), 2, 2), dtype=complex)
+        out[:, 0, 0] = omega
+        out[:, 0, 1] = ft - 1j*gt
+        out[:, 1, 0] = ft + 1j*gt
+        out[:, 1, 1] = -omega
+        return out
     return H
 
 def two_spins(H1_coeff, H2_coeff, HJ=0):